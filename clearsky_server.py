@@ -21,6 +21,9 @@ from clearsky import (
     get_oauth2_token, get_token, get_jordan_polygon, is_point_in_jordan,
     get_flights, BBOX, SOURCE_MAP, beep, BEEP_MODE, BEEP_SAMPLES, BEEP_SAMPLE_PATH
 )
+from enrichment import load_enrichment, enrichment_ready, enrich_flights
+from rollups import load_rollups, fold_snapshot, flush_rollups, get_heatmap, get_rollups
+from snapshot_map import init_map_renderer, start_basemap_fetcher, map_generation, render_map_png
 
 print("[LOG] Importing clearsky_server.py and loading credentials...")
 
@@ -53,6 +56,10 @@ def update_flight_data():
     print("[LOG] Starting flight data update thread...")
     jordan_polygon = get_jordan_polygon()
     print("[LOG] Jordan polygon loaded: {}".format('OK' if jordan_polygon else 'FAILED'))
+    init_map_renderer(jordan_polygon, BBOX)
+    start_basemap_fetcher()
+    print("[LOG] Enrichment index loaded: {}".format('OK' if load_enrichment() else 'NOT READY'))
+    print("[LOG] Traffic rollups: {}".format('RESTORED' if load_rollups(BBOX) else 'NEW'))
     
     while True:
         try:
@@ -104,7 +111,10 @@ def update_flight_data():
                     flights_dict[flight[0]] = flight_data  # Overwrite duplicates
                     if inside:
                         jordan_flights.append(flight_data)
+            if enrichment_ready():
+                enrich_flights(list(flights_dict.values()))
             print(f"[LOG] Processed {len(flights_dict)} flights, {len(jordan_flights)} over Jordan")
+            fold_snapshot(list(flights_dict.values()), now)
             # Update global state
             with data_lock:
                 current_data['timestamp'] = now.isoformat()
@@ -157,6 +167,12 @@ class ClearSkyHTTPHandler(BaseHTTPRequestHandler):
             self.send_jordan_flights_response()
         elif path == '/api/jordan_polygon':
             self.send_jordan_polygon_response()
+        elif path == '/api/heatmap':
+            self.send_heatmap_response(parse_qs(parsed_url.query))
+        elif path == '/api/rollups':
+            self.send_rollups_response()
+        elif path == '/api/map.png':
+            self.send_map_png_response()
         else:
             self.send_error(404, "Not Found")
     
@@ -229,6 +245,67 @@ class ClearSkyHTTPHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(geojson).encode('utf-8'))
     
+    def send_heatmap_response(self, query):
+        """Send per-cell traffic counts, optionally for one UTC weekday (0=Mon) and/or hour"""
+        try:
+            weekday = int(query['weekday'][0]) if 'weekday' in query else None
+            hour = int(query['hour'][0]) if 'hour' in query else None
+            if (weekday is not None and not 0 <= weekday <= 6) or (hour is not None and not 0 <= hour <= 23):
+                raise ValueError
+        except ValueError:
+            self.send_error(400, "weekday must be 0-6 and hour 0-23")
+            return
+        heatmap = get_heatmap(weekday, hour)
+        if heatmap is None:
+            self.send_error(503, "Rollups not loaded yet")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(heatmap).encode('utf-8'))
+    
+    def send_rollups_response(self):
+        """Send inside/outside polygon counts by hour and weekday plus top airlines/countries"""
+        rollups = get_rollups()
+        if rollups is None:
+            self.send_error(503, "Rollups not loaded yet")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(rollups, indent=2).encode('utf-8'))
+    
+    def send_map_png_response(self):
+        """Send the current snapshot rendered as a PNG map"""
+        with data_lock:
+            timestamp = current_data['timestamp']
+            flights = current_data['flights']
+        if timestamp is None:
+            self.send_error(503, "No flight data yet")
+            return
+        # The generation changes when the basemap arrives, even if the snapshot does not
+        etag = f'"{timestamp}-{map_generation()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        try:
+            png = render_map_png(timestamp, flights)
+        except Exception as e:
+            traceback.print_exc()
+            self.send_error(500, f"Could not render map: {e}")
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'image/png')
+        self.send_header('Content-Length', str(len(png)))
+        self.send_header('ETag', etag)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(png)
+    
     def log_message(self, format, *args):
         """Custom logging to avoid cluttering the console"""
         pass
@@ -257,6 +334,7 @@ def main():
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
+        flush_rollups()
     except Exception as e:
         print(f"❌ Server error: {e}")
 
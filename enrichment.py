@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Aircraft and airline enrichment for ClearSky.
+Builds a compact SQLite index from local reference datasets and looks up
+registration, aircraft type and airline names per refresh in one batch.
+
+Reference data (not tracked by git):
+- data/aircraftDatabase.csv — OpenSky aircraft database
+  (https://opensky-network.org/datasets/metadata/)
+- data/airlines.dat — ICAO airline designators in OpenFlights format
+  (https://github.com/jpatokal/openflights/blob/master/data/airlines.dat)
+
+Run `python enrichment.py` to (re)build data/enrichment.sqlite.
+"""
+
+import csv
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+DATA_DIR = Path("data")
+AIRCRAFT_CSV = DATA_DIR / "aircraftDatabase.csv"
+AIRLINES_CSV = DATA_DIR / "airlines.dat"
+INDEX_DB = DATA_DIR / "enrichment.sqlite"
+
+# Max entries kept in each in-memory LRU (the index itself stays on disk)
+CACHE_SIZE = 20000
+# SQLite limits the number of bound parameters per statement
+QUERY_CHUNK = 500
+INSERT_CHUNK = 10000
+
+# Columns taken from the OpenSky aircraft database
+AIRCRAFT_COLUMNS = ['registration', 'typecode', 'model', 'manufacturername', 'operator']
+
+_conn = None
+_conn_lock = threading.Lock()
+_build_thread = None
+_aircraft_cache = OrderedDict()  # icao24 -> dict or None
+_airline_cache = OrderedDict()   # ICAO designator -> dict or None
+
+
+def airline_designator(callsign):
+    """ICAO airline designator of a callsign like RJA123, or '' if it is not one"""
+    callsign = (callsign or '').strip().upper()
+    prefix = callsign[:3]
+    # Registrations used as callsigns (JY-ABC, JYAYL, N123AB) have no letters+digit pattern
+    if len(callsign) < 4 or not callsign[3].isdigit() or not (prefix.isascii() and prefix.isalpha()):
+        return ''
+    return prefix
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _iter_aircraft_rows(path):
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            icao24 = (row.get('icao24') or '').strip().lower()
+            if not icao24:
+                continue
+            values = [(row.get(col) or '').strip() for col in AIRCRAFT_COLUMNS]
+            if any(values):
+                yield (icao24, *values)
+
+
+def _iter_airline_rows(path):
+    # OpenFlights layout: id, name, alias, IATA, ICAO, callsign, country, active
+    # Designators are reused, so an active carrier wins over defunct rows for the same ICAO code
+    airlines = {}
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 7:
+                continue
+            # OpenFlights uses \N for missing values
+            row = ['' if value.strip() == '\\N' else value.strip() for value in row]
+            icao = row[4].upper()
+            if len(icao) != 3 or not (icao.isascii() and icao.isalpha()):
+                continue
+            active = len(row) > 7 and row[7] == 'Y'
+            if icao in airlines and not active:
+                continue
+            airlines[icao] = (icao, row[1], row[5], row[6])
+    yield from airlines.values()
+
+
+def build_index(aircraft_csv=AIRCRAFT_CSV, airlines_csv=AIRLINES_CSV, index_db=INDEX_DB):
+    """Build the on-disk lookup index from the reference CSV files"""
+    index_db = Path(index_db)
+    index_db.parent.mkdir(parents=True, exist_ok=True)
+    tmp_db = index_db.with_suffix('.tmp')
+    if tmp_db.exists():
+        tmp_db.unlink()
+    conn = sqlite3.connect(tmp_db)
+    try:
+        # WITHOUT ROWID stores rows directly in the primary key B-tree
+        conn.execute(
+            "CREATE TABLE aircraft (icao24 TEXT PRIMARY KEY, registration TEXT, "
+            "typecode TEXT, model TEXT, manufacturer TEXT, operator TEXT) WITHOUT ROWID"
+        )
+        conn.execute(
+            "CREATE TABLE airlines (icao TEXT PRIMARY KEY, name TEXT, "
+            "callsign TEXT, country TEXT) WITHOUT ROWID"
+        )
+        counts = {'aircraft': 0, 'airlines': 0}
+        sources = [
+            ('aircraft', Path(aircraft_csv), _iter_aircraft_rows, 6),
+            ('airlines', Path(airlines_csv), _iter_airline_rows, 4),
+        ]
+        for table, path, iter_rows, width in sources:
+            if not path.exists():
+                print(f"[ENRICH] {path} not found, skipping {table}")
+                continue
+            placeholders = ','.join('?' * width)
+            batch = []
+            for row in iter_rows(path):
+                batch.append(row)
+                if len(batch) >= INSERT_CHUNK:
+                    conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", batch)
+                    counts[table] += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", batch)
+                counts[table] += len(batch)
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_db, index_db)
+    print(f"[ENRICH] Indexed {counts['aircraft']} aircraft and {counts['airlines']} airlines into {index_db}")
+    return counts
+
+
+def _index_is_stale():
+    if not INDEX_DB.exists():
+        return True
+    index_mtime = INDEX_DB.stat().st_mtime
+    return any(p.exists() and p.stat().st_mtime > index_mtime for p in (AIRCRAFT_CSV, AIRLINES_CSV))
+
+
+def _open_index():
+    global _conn
+    conn = sqlite3.connect(f"file:{INDEX_DB}?mode=ro", uri=True, check_same_thread=False)
+    with _conn_lock:
+        if _conn is not None:
+            _conn.close()
+        _conn = conn
+        _aircraft_cache.clear()
+        _airline_cache.clear()
+
+
+def _rebuild_index():
+    try:
+        build_index()
+        _open_index()
+        print("[ENRICH] Enrichment index ready")
+    except Exception as e:
+        print(f"[ENRICH] Could not rebuild enrichment index: {e}")
+
+
+def load_enrichment():
+    """Open the lookup index; if the reference data changed, rebuild it in a background thread"""
+    global _build_thread
+    try:
+        if INDEX_DB.exists():
+            # A stale index keeps serving lookups until the rebuild replaces it
+            _open_index()
+        if _index_is_stale():
+            if not (AIRCRAFT_CSV.exists() or AIRLINES_CSV.exists()):
+                print(f"[ENRICH] No reference data in {DATA_DIR}/, enrichment disabled")
+            elif _build_thread is None or not _build_thread.is_alive():
+                print("[ENRICH] Reference data changed, rebuilding index in the background...")
+                _build_thread = threading.Thread(target=_rebuild_index, daemon=True)
+                _build_thread.start()
+    except Exception as e:
+        print(f"[ENRICH] Could not load enrichment index: {e}")
+    return enrichment_ready()
+
+
+def enrichment_ready():
+    """True once an index is open for lookups"""
+    return _conn is not None
+
+
+def _cache_put(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+
+def _lookup_many(cache, table, key_col, columns, keys):
+    """Resolve keys through the LRU, querying the index once per chunk of misses"""
+    results = {}
+    # One critical section for read, query and write, so an index swap in
+    # _open_index() cannot clear the cache between them and let old results in
+    with _conn_lock:
+        missing = []
+        for key in keys:
+            if key in cache:
+                cache.move_to_end(key)
+                results[key] = cache[key]
+            else:
+                missing.append(key)
+        if missing and _conn is not None:
+            found = {}
+            for chunk in _chunks(missing, QUERY_CHUNK):
+                query = (f"SELECT {key_col}, {', '.join(columns)} FROM {table} "
+                         f"WHERE {key_col} IN ({','.join('?' * len(chunk))})")
+                for row in _conn.execute(query, chunk):
+                    found[row[0]] = dict(zip(columns, row[1:]))
+            for key in missing:
+                # Negative results are cached too so unknown aircraft stay cheap
+                results[key] = found.get(key)
+                _cache_put(cache, key, results[key])
+    return results
+
+
+def lookup_aircraft(icao24_list):
+    """Return {icao24: {'registration', 'typecode', 'model', ...} or None}"""
+    keys = list({k.strip().lower() for k in icao24_list if k})
+    return _lookup_many(_aircraft_cache, 'aircraft', 'icao24',
+                        ['registration', 'typecode', 'model', 'manufacturer', 'operator'], keys)
+
+
+def lookup_airlines(icao_codes):
+    """Return {ICAO designator: {'name', 'callsign', 'country'} or None}"""
+    keys = list({k.strip().upper() for k in icao_codes if k})
+    return _lookup_many(_airline_cache, 'airlines', 'icao',
+                        ['name', 'callsign', 'country'], keys)
+
+
+def enrich_flights(flights):
+    """Add airline name, registration and aircraft type to flight dicts in place"""
+    aircraft = lookup_aircraft(f['icao24'] for f in flights if f.get('icao24'))
+    designators = [airline_designator(f.get('callsign')) for f in flights]
+    airlines = lookup_airlines(d for d in designators if d)
+    for flight, designator in zip(flights, designators):
+        info = aircraft.get((flight.get('icao24') or '').lower()) or {}
+        airline = airlines.get(designator) or {}
+        flight['airline_name'] = airline.get('name') or info.get('operator') or ''
+        flight['registration'] = info.get('registration') or ''
+        flight['aircraft_type'] = info.get('typecode') or ''
+        flight['aircraft_model'] = ' '.join(
+            p for p in (info.get('manufacturer'), info.get('model')) if p
+        )
+    return flights
+
+
+if __name__ == "__main__":
+    build_index()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Traffic density rollups for ClearSky.
+Each refresh is folded into fixed-size counters (grid cells by weekday and
+hour, inside/outside polygon, airline and origin country tallies) that are
+flushed to disk periodically, so long-range queries never scan raw history.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+from enrichment import airline_designator
+
+ROLLUPS_FILE = Path("data/rollups.npz")
+
+CELL_SIZE = 0.25        # Grid cell size in degrees
+FLUSH_EVERY = 10        # Snapshots between writes to disk
+TOP_N = 20              # Entries returned for airline/country tallies
+MAX_COUNTRIES = 255     # Origin countries tracked by name; the rest count as 'Other'
+AIRLINE_SLOTS = 26 ** 3 # One slot per possible 3-letter ICAO airline designator
+TIMEZONE = 'UTC'        # Weekday/hour buckets ignore the server's local timezone and DST
+
+_lock = threading.Lock()
+_bbox = None
+_shape = None           # (rows, cols) of the grid
+_grid = None            # uint32[7 weekdays][24 hours][rows][cols] aircraft sightings
+_polygon = None         # uint32[7][24][2] sightings outside (0) / inside (1) the polygon
+_snapshots = None       # uint32[7][24] snapshots folded into each bucket
+_airlines = None        # uint32[AIRLINE_SLOTS] sightings per ICAO designator
+_countries = None       # uint32[MAX_COUNTRIES + 1] sightings per origin country, last slot 'Other'
+_country_names = []     # country slot -> name
+_country_slots = {}     # name -> country slot
+_first_snapshot = None
+_last_snapshot = None
+_pending = 0
+
+
+def _grid_shape(bbox):
+    rows = int(np.ceil((bbox['lamax'] - bbox['lamin']) / CELL_SIZE))
+    cols = int(np.ceil((bbox['lomax'] - bbox['lomin']) / CELL_SIZE))
+    return rows, cols
+
+
+def _airline_slot(callsign):
+    """Slot of the ICAO designator in an airline callsign like RJA123, or None"""
+    prefix = airline_designator(callsign)
+    if not prefix:
+        return None
+    return (ord(prefix[0]) - 65) * 676 + (ord(prefix[1]) - 65) * 26 + (ord(prefix[2]) - 65)
+
+
+def _airline_code(slot):
+    return chr(65 + slot // 676) + chr(65 + slot // 26 % 26) + chr(65 + slot % 26)
+
+
+def _country_slot(name):
+    slot = _country_slots.get(name)
+    if slot is None:
+        if len(_country_names) >= MAX_COUNTRIES:
+            return MAX_COUNTRIES
+        slot = len(_country_names)
+        _country_names.append(name)
+        _country_slots[name] = slot
+    return slot
+
+
+def _reset(bbox):
+    global _bbox, _shape, _grid, _polygon, _snapshots, _airlines, _countries
+    global _country_names, _country_slots
+    global _first_snapshot, _last_snapshot, _pending
+    _bbox = dict(bbox)
+    _shape = _grid_shape(bbox)
+    _grid = np.zeros((7, 24) + _shape, dtype=np.uint32)
+    _polygon = np.zeros((7, 24, 2), dtype=np.uint32)
+    _snapshots = np.zeros((7, 24), dtype=np.uint32)
+    _airlines = np.zeros(AIRLINE_SLOTS, dtype=np.uint32)
+    _countries = np.zeros(MAX_COUNTRIES + 1, dtype=np.uint32)
+    _country_names = []
+    _country_slots = {}
+    _first_snapshot = None
+    _last_snapshot = None
+    _pending = 0
+
+
+def load_rollups(bbox):
+    """Load persisted rollups for this bounding box, or start empty"""
+    global _grid, _polygon, _snapshots, _airlines, _countries, _country_names, _country_slots
+    global _first_snapshot, _last_snapshot
+    with _lock:
+        _reset(bbox)
+        if not ROLLUPS_FILE.exists():
+            return False
+        try:
+            with np.load(ROLLUPS_FILE) as data:
+                meta = json.loads(str(data['meta']))
+                if (meta.get('bbox') != _bbox or meta.get('cell_size') != CELL_SIZE
+                        or meta.get('timezone') != TIMEZONE
+                        or data['countries'].shape != _countries.shape):
+                    print(f"[ROLLUP] Rollup layout changed, starting new rollups instead of {ROLLUPS_FILE}")
+                    return False
+                _grid = data['grid'].astype(np.uint32)
+                _polygon = data['polygon'].astype(np.uint32)
+                _snapshots = data['snapshots'].astype(np.uint32)
+                _airlines = data['airlines'].astype(np.uint32)
+                _countries = data['countries'].astype(np.uint32)
+            _country_names = list(meta.get('country_names', []))
+            _country_slots = {name: slot for slot, name in enumerate(_country_names)}
+            _first_snapshot = meta.get('first_snapshot')
+            _last_snapshot = meta.get('last_snapshot')
+            return True
+        except Exception as e:
+            print(f"[ROLLUP] Could not load {ROLLUPS_FILE}: {e}")
+            _reset(bbox)
+            return False
+
+
+def _flush_locked():
+    global _pending
+    meta = {
+        'bbox': _bbox,
+        'cell_size': CELL_SIZE,
+        'timezone': TIMEZONE,
+        'country_names': _country_names,
+        'first_snapshot': _first_snapshot,
+        'last_snapshot': _last_snapshot,
+    }
+    ROLLUPS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    # np.savez appends .npz unless the name already ends with it
+    tmp_file = ROLLUPS_FILE.with_name(ROLLUPS_FILE.stem + '.tmp.npz')
+    np.savez(tmp_file, grid=_grid, polygon=_polygon, snapshots=_snapshots,
+             airlines=_airlines, countries=_countries, meta=np.array(json.dumps(meta)))
+    os.replace(tmp_file, ROLLUPS_FILE)
+    _pending = 0
+
+
+def flush_rollups():
+    """Write the current rollups to disk"""
+    with _lock:
+        if _grid is None or _pending == 0:
+            return
+        try:
+            _flush_locked()
+        except Exception as e:
+            print(f"[ROLLUP] Could not write {ROLLUPS_FILE}: {e}")
+
+
+def fold_snapshot(flights, when=None):
+    """Add one refresh worth of flight dicts to the rollups; naive times are taken as local"""
+    global _first_snapshot, _last_snapshot, _pending
+    when = (when or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    weekday, hour = when.weekday(), when.hour
+    lats = np.array([f['latitude'] for f in flights], dtype=float)
+    lons = np.array([f['longitude'] for f in flights], dtype=float)
+    inside = np.array([bool(f['inside_polygon']) for f in flights], dtype=int)
+    with _lock:
+        if _grid is None:
+            return
+        rows = np.floor((lats - _bbox['lamin']) / CELL_SIZE).astype(int)
+        cols = np.floor((lons - _bbox['lomin']) / CELL_SIZE).astype(int)
+        valid = (rows >= 0) & (rows < _shape[0]) & (cols >= 0) & (cols < _shape[1])
+        np.add.at(_grid[weekday, hour], (rows[valid], cols[valid]), 1)
+        _polygon[weekday, hour] += np.bincount(inside, minlength=2).astype(np.uint32)
+        _snapshots[weekday, hour] += 1
+        airline_slots = [_airline_slot(f.get('callsign')) for f in flights]
+        np.add.at(_airlines, np.array([slot for slot in airline_slots if slot is not None], dtype=int), 1)
+        np.add.at(_countries, np.array([_country_slot(f['country']) for f in flights if f.get('country')], dtype=int), 1)
+        _first_snapshot = _first_snapshot or when.isoformat()
+        _last_snapshot = when.isoformat()
+        _pending += 1
+        if _pending >= FLUSH_EVERY:
+            try:
+                _flush_locked()
+            except Exception as e:
+                print(f"[ROLLUP] Could not write {ROLLUPS_FILE}: {e}")
+
+
+def get_heatmap(weekday=None, hour=None):
+    """Sightings per grid cell, optionally restricted to a UTC weekday and/or hour"""
+    with _lock:
+        if _grid is None:
+            return None
+        days = slice(None) if weekday is None else slice(weekday, weekday + 1)
+        hours = slice(None) if hour is None else slice(hour, hour + 1)
+        counts = _grid[days, hours].sum(axis=(0, 1), dtype=np.uint64)
+        snapshots = int(_snapshots[days, hours].sum())
+        bbox = dict(_bbox)
+    return {
+        'bbox': bbox,
+        'cell_size': CELL_SIZE,
+        'rows': counts.shape[0],
+        'cols': counts.shape[1],
+        'timezone': TIMEZONE,
+        'weekday': weekday,
+        'hour': hour,
+        'snapshots': snapshots,
+        'max': int(counts.max()) if counts.size else 0,
+        'counts': counts.tolist(),  # counts[row][col], row 0 at lamin
+    }
+
+
+def _top_slots(counts):
+    slots = np.argsort(counts, kind='stable')[::-1][:TOP_N]
+    return [int(slot) for slot in slots if counts[slot] > 0]
+
+
+def get_rollups():
+    """Inside/outside polygon counts by hour and weekday plus top tallies"""
+    with _lock:
+        if _grid is None:
+            return None
+        by_hour = _polygon.sum(axis=0, dtype=np.uint64)
+        by_weekday = _polygon.sum(axis=1, dtype=np.uint64)
+        snapshots_by_hour = _snapshots.sum(axis=0, dtype=np.uint64)
+        snapshots_by_weekday = _snapshots.sum(axis=1, dtype=np.uint64)
+        result = {
+            'timezone': TIMEZONE,
+            'first_snapshot': _first_snapshot,
+            'last_snapshot': _last_snapshot,
+            'snapshots': int(_snapshots.sum()),
+            'inside_polygon': int(_polygon[..., 1].sum()),
+            'outside_polygon': int(_polygon[..., 0].sum()),
+            'by_hour': [
+                {'hour': h, 'snapshots': int(snapshots_by_hour[h]),
+                 'outside': int(by_hour[h, 0]), 'inside': int(by_hour[h, 1])}
+                for h in range(24)
+            ],
+            'by_weekday': [
+                {'weekday': d, 'snapshots': int(snapshots_by_weekday[d]),
+                 'outside': int(by_weekday[d, 0]), 'inside': int(by_weekday[d, 1])}
+                for d in range(7)
+            ],
+            'airlines': [(_airline_code(slot), int(_airlines[slot])) for slot in _top_slots(_airlines)],
+            'countries': [(_country_names[slot] if slot < MAX_COUNTRIES else 'Other', int(_countries[slot]))
+                          for slot in _top_slots(_countries)],
+        }
+    return result
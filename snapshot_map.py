@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Headless map snapshots for ClearSky.
+Renders the border and aircraft onto an OpenStreetMap basemap without a Qt
+window. Basemap tiles are cached on disk, the static background is drawn once
+and blitted, and the PNG is only re-rendered when the snapshot timestamp changes.
+
+Usage: python snapshot_map.py [--output map.png] [--count N] [--interval SECONDS]
+"""
+
+import argparse
+import io
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.lines import Line2D
+import matplotlib.image as mpimg
+import contextily as ctx
+
+TILE_CACHE_DIR = Path("data/tiles")
+MAP_WIDTH = 1200        # Output width in pixels (height follows the bbox aspect)
+MAP_DPI = 100
+MAP_ZOOM = 7            # Basemap tile zoom level
+ARROW_SIZE = 0.22       # Aircraft arrow length in inches
+BASEMAP_TIMEOUT = 10    # Seconds per tile request
+BASEMAP_RETRY_MIN = 60  # Backoff between basemap attempts while tiles are unreachable
+BASEMAP_RETRY_MAX = 3600
+
+EARTH_RADIUS = 6378137.0
+
+_lock = threading.Lock()
+_polygon = None
+_bbox = None
+_figure = None
+_canvas = None
+_ax = None
+_background = None
+_has_basemap = False
+_cached_timestamp = None
+_cached_png = None
+_next_basemap_attempt = 0
+_basemap_retry_delay = BASEMAP_RETRY_MIN
+_fetch_thread = None
+_generation = 0         # Bumped whenever the background changes, so cached maps can be told apart
+
+
+def to_web_mercator(lon, lat):
+    """Project lon/lat degrees to EPSG:3857 metres (the basemap tile CRS)"""
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    x = EARTH_RADIUS * np.radians(lon)
+    y = EARTH_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+
+def init_map_renderer(polygon, bbox):
+    """Set the border polygon and bounding box; the basemap is fetched separately"""
+    global _polygon, _bbox, _background, _has_basemap, _cached_timestamp, _cached_png
+    global _next_basemap_attempt, _basemap_retry_delay, _generation
+    with _lock:
+        _polygon = polygon
+        _bbox = dict(bbox)
+        _background = None
+        _generation += 1
+        _has_basemap = False
+        _cached_timestamp = None
+        _cached_png = None
+        _next_basemap_attempt = 0
+        _basemap_retry_delay = BASEMAP_RETRY_MIN
+
+
+def _fetch_basemap(bbox):
+    TILE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    ctx.set_cache_dir(str(TILE_CACHE_DIR))
+    return ctx.bounds2img(bbox['lomin'], bbox['lamin'], bbox['lomax'], bbox['lamax'],
+                          zoom=MAP_ZOOM, source=ctx.providers.OpenStreetMap.Mapnik, ll=True,
+                          timeout=BASEMAP_TIMEOUT)
+
+
+def _build_background(polygon, bbox, basemap=None):
+    """Draw basemap, border and legend once and keep the pixels for blitting"""
+    (x0, x1), (y0, y1) = to_web_mercator(
+        [bbox['lomin'], bbox['lomax']], [bbox['lamin'], bbox['lamax']])
+    height = MAP_WIDTH * (y1 - y0) / (x1 - x0)
+    figure = Figure(figsize=(MAP_WIDTH / MAP_DPI, height / MAP_DPI), dpi=MAP_DPI)
+    canvas = FigureCanvasAgg(figure)
+    ax = figure.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    if basemap is not None:
+        img, extent = basemap
+        ax.imshow(img, extent=extent, interpolation='bilinear')
+    if polygon is not None:
+        for poly in getattr(polygon, 'geoms', [polygon]):
+            px, py = to_web_mercator(*poly.exterior.xy)
+            ax.plot(px, py, color='blue', linewidth=2)
+    ax.set_xlim(x0, x1)
+    ax.set_ylim(y0, y1)
+    ax.legend(handles=[
+        Line2D([], [], color='blue', linewidth=2, label='Jordan Border'),
+        Line2D([], [], marker='^', color='red', linestyle='', label='Inside Polygon'),
+        Line2D([], [], marker='^', color='green', linestyle='', label='Outside Polygon'),
+    ], loc='upper right')
+    canvas.draw()
+    return figure, canvas, ax, canvas.copy_from_bbox(figure.bbox)
+
+
+def refresh_basemap():
+    """Fetch the basemap if it is still missing and a retry is due.
+    Runs outside the render lock so requests keep being served meanwhile."""
+    global _figure, _canvas, _ax, _background, _has_basemap, _cached_timestamp, _cached_png
+    global _next_basemap_attempt, _basemap_retry_delay, _generation
+    with _lock:
+        if _bbox is None or _has_basemap or time.time() < _next_basemap_attempt:
+            return
+        polygon, bbox = _polygon, _bbox
+        retry_delay = _basemap_retry_delay
+    try:
+        basemap = _fetch_basemap(bbox)
+    except Exception as e:
+        print(f"[MAP] Basemap error: {e} (retrying in {retry_delay}s)")
+        with _lock:
+            if bbox == _bbox:
+                _next_basemap_attempt = time.time() + retry_delay
+                _basemap_retry_delay = min(retry_delay * 2, BASEMAP_RETRY_MAX)
+        # render_map_png() draws its own plain background when none exists
+        return
+    state = _build_background(polygon, bbox, basemap)
+    with _lock:
+        if bbox != _bbox:
+            return
+        _figure, _canvas, _ax, _background = state
+        _has_basemap = True
+        _generation += 1
+        _cached_timestamp = None
+        _cached_png = None
+
+
+def _basemap_fetch_loop():
+    while True:
+        refresh_basemap()
+        with _lock:
+            if _has_basemap:
+                return
+            wait = max(1, _next_basemap_attempt - time.time())
+        time.sleep(wait)
+
+
+def start_basemap_fetcher():
+    """Fetch the basemap in a daemon thread, retrying on the backoff until it succeeds"""
+    global _fetch_thread
+    if _fetch_thread is None or not _fetch_thread.is_alive():
+        _fetch_thread = threading.Thread(target=_basemap_fetch_loop, daemon=True)
+        _fetch_thread.start()
+
+
+def _draw_aircraft(timestamp, flights):
+    positioned = [f for f in flights if f.get('longitude') is not None and f.get('latitude') is not None]
+    artists = []
+    inside_count = sum(1 for f in positioned if f.get('inside_polygon'))
+    with_heading = [f for f in positioned if f.get('heading') is not None]
+    without_heading = [f for f in positioned if f.get('heading') is None]
+    if with_heading:
+        x, y = to_web_mercator([f['longitude'] for f in with_heading], [f['latitude'] for f in with_heading])
+        headings = np.radians([f['heading'] for f in with_heading])
+        colors = ['red' if f.get('inside_polygon') else 'green' for f in with_heading]
+        artists.append(_ax.quiver(x, y, np.sin(headings), np.cos(headings), color=colors,
+                                  edgecolor='black', linewidth=0.8, angles='uv', pivot='middle',
+                                  scale=1 / ARROW_SIZE, scale_units='inches', width=0.006,
+                                  animated=True))
+    if without_heading:
+        x, y = to_web_mercator([f['longitude'] for f in without_heading], [f['latitude'] for f in without_heading])
+        colors = ['red' if f.get('inside_polygon') else 'green' for f in without_heading]
+        artists.append(_ax.scatter(x, y, c=colors, s=50, edgecolors='black', animated=True))
+    label = datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:%M:%S') if timestamp else 'No data'
+    artists.append(_ax.text(0.01, 0.99, f"{label}  |  {len(positioned)} flights, {inside_count} over Jordan",
+                            transform=_ax.transAxes, ha='left', va='top', fontsize=12,
+                            bbox={'facecolor': 'white', 'alpha': 0.8, 'edgecolor': 'none'},
+                            animated=True))
+    _canvas.restore_region(_background)
+    for artist in artists:
+        _ax.draw_artist(artist)
+    pixels = np.asarray(_canvas.buffer_rgba()).copy()
+    for artist in artists:
+        artist.remove()
+    buf = io.BytesIO()
+    mpimg.imsave(buf, pixels, format='png')
+    return buf.getvalue()
+
+
+def map_generation():
+    """Counter that changes whenever the map background (basemap, border) changes"""
+    with _lock:
+        return _generation
+
+
+def render_map_png(timestamp, flights):
+    """Return PNG bytes for the snapshot, reusing the last render if the timestamp is unchanged"""
+    global _figure, _canvas, _ax, _background, _cached_timestamp, _cached_png
+    with _lock:
+        if _bbox is None:
+            raise RuntimeError("init_map_renderer() has not been called")
+        if _cached_png is not None and timestamp == _cached_timestamp:
+            return _cached_png
+        # Never fetch tiles here; refresh_basemap() adds the basemap from the update thread
+        if _background is None:
+            _figure, _canvas, _ax, _background = _build_background(_polygon, _bbox)
+        _cached_png = _draw_aircraft(timestamp, flights)
+        _cached_timestamp = timestamp
+        return _cached_png
+
+
+def main():
+    """Fetch flights from OpenSky and write map snapshots without opening a window"""
+    parser = argparse.ArgumentParser(description="Render ClearSky map snapshots headlessly")
+    parser.add_argument('--output', default='snapshot-{timestamp}.png',
+                        help="Output path; {timestamp} is replaced per snapshot")
+    parser.add_argument('--count', type=int, default=1, help="Number of snapshots to render")
+    parser.add_argument('--interval', type=int, default=60, help="Seconds between snapshots")
+    args = parser.parse_args()
+
+    from shapely.geometry import Point
+    from clearsky import get_flights, get_jordan_polygon, is_point_in_jordan, BBOX
+
+    polygon = get_jordan_polygon()
+    init_map_renderer(polygon, BBOX)
+    for i in range(args.count):
+        refresh_basemap()
+        now = datetime.now()
+        flights = []
+        for flight in get_flights(BBOX) or []:
+            lon, lat = flight[5], flight[6]
+            if lon is None or lat is None:
+                continue
+            flights.append({
+                'callsign': flight[1].strip() if flight[1] is not None else '',
+                'longitude': lon,
+                'latitude': lat,
+                'heading': flight[10],
+                'inside_polygon': is_point_in_jordan(Point(lon, lat), polygon),
+            })
+        output = Path(args.output.format(timestamp=now.strftime('%Y%m%d-%H%M%S')))
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_bytes(render_map_png(now.isoformat(), flights))
+        print(f"[MAP] Wrote {output} with {len(flights)} flights")
+        if i < args.count - 1:
+            time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()